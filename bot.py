@@ -1,14 +1,15 @@
 import discord
 from discord.ext import tasks, commands
-import requests
-import json
+import aiohttp
+import orjson
 import os
 import asyncio
 from dotenv import load_dotenv
 from datetime import datetime, time
+from time import monotonic
 from zoneinfo import ZoneInfo
 
-from utils.update_root_flags import check_root_flags_manual
+from utils.update_root_flags import check_root_flags_async
 
 # ================= CONFIGURATION =================
 # Load the .env file
@@ -37,6 +38,19 @@ GOAL_MACHINES = 1
 GOAL_CHALLENGES = 2
 
 DB_FILE = "htb_data.json"
+CHALLENGE_CACHE_FILE = "challenge_cache.json"
+
+# The DB is written to disk at most once every this many seconds
+SAVE_INTERVAL_SECONDS = 5
+
+# How long (seconds) a user's name/avatar is reused before re-fetching
+USER_DETAILS_TTL = 3600
+
+# Max concurrent requests to the HTB API (respect their rate limits)
+HTB_MAX_CONCURRENCY = 10
+
+# Max embeds Discord accepts in a single message
+DISCORD_MAX_EMBEDS = 10
 # =================================================
 
 # --- BOT SETUP ---
@@ -44,7 +58,48 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+class TrackerBot(commands.Bot):
+    async def setup_hook(self):
+        # One shared HTTP session (connection pool) for every HTB API call.
+        # Created here so it exists before any command can be dispatched.
+        self.http_session = aiohttp.ClientSession(
+            headers={
+                "Authorization": f"Bearer {HTB_API_TOKEN}",
+                "User-Agent": "DiscordBot/1.0",
+                "Accept": "application/json",
+            },
+            timeout=aiohttp.ClientTimeout(total=10),
+        )
+        await self.add_cog(Tracker(self))
+        self.db_saver_task = asyncio.create_task(db_saver())
+
+    async def close(self):
+        await super().close()
+        if getattr(self, "http_session", None) is not None:
+            await self.http_session.close()
+
+
+bot = TrackerBot(command_prefix="!", intents=intents)
+
+# --- EMBED TEMPLATES ---
+# Static parts of the embeds, built once and copied per use
+EMBED_TEMPLATES = {
+    "new_agent": discord.Embed(
+        title="🕵️ New Agent Tracked!", color=discord.Color.blue()
+    ),
+    "stats": discord.Embed(color=discord.Color.purple()),
+    "top": discord.Embed(
+        title="🏆 Weekly Hacker Leaderboard",
+        description="Ranked by Total Solves (Machines + Challenges)",
+        color=discord.Color.gold(),
+    ),
+    "reset": discord.Embed(
+        title="🗓️ Weekly Reset & Report",
+        description="The week has ended! Here is the breakdown:",
+        color=discord.Color.dark_grey(),
+    ),
+}
 
 
 # ================= DATABASE FUNCTIONS =================
@@ -52,9 +107,9 @@ def load_db():
     data = {"users": {}}
     if os.path.exists(DB_FILE):
         try:
-            with open(DB_FILE, "r") as f:
-                data = json.load(f)
-        except json.JSONDecodeError:
+            with open(DB_FILE, "rb") as f:
+                data = orjson.loads(f.read())
+        except orjson.JSONDecodeError:
             print("⚠️ JSON Corrupt. Starting fresh (Old file backed up).")
             os.rename(DB_FILE, f"{DB_FILE}.bak")
 
@@ -63,57 +118,160 @@ def load_db():
         for uid, user_data in data["users"].items():
             if "streak" not in user_data:
                 user_data["streak"] = 0
-            if "user_flag_ids" not in user_data:
-                user_data["user_flag_ids"] = []
-            if "root_flag_ids" not in user_data:
-                user_data["root_flag_ids"] = []
+            # ID lists are stored as JSON arrays but kept as sets in memory
+            for key in ("solved_ids", "user_flag_ids", "root_flag_ids"):
+                user_data[key] = set(user_data.get(key, []))
+            # Legacy user flags were stored as "<machine id>_user" strings
+            user_data["user_flag_ids"] = {
+                fid if isinstance(fid, int) else int(fid.split("_")[0])
+                for fid in user_data["user_flag_ids"]
+                if isinstance(fid, int) or fid.split("_")[0].isdigit()
+            }
     return data
 
 
-def save_db(data):
-    with open(DB_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+def json_default(obj):
+    """Serializes the in-memory sets back to (sorted) JSON arrays."""
+    if isinstance(obj, set):
+        return sorted(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def write_file_atomic(path, payload):
+    # Write to a temp file first so a crash never leaves a half-written file
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_file, path)
+
+
+async def save_db(data):
+    """Serializes the DB on the event loop and writes it in a worker thread."""
+    # Serializing here means the worker never sees the dict mid-update
+    payload = orjson.dumps(data, default=json_default, option=orjson.OPT_INDENT_2)
+    await asyncio.to_thread(write_file_atomic, DB_FILE, payload)
+
+
+save_requested = asyncio.Event()
+
+
+def request_save():
+    """Marks the DB as modified; db_saver() writes it out shortly after."""
+    save_requested.set()
+
+
+async def db_saver():
+    """Background task: writes the DB at most once per SAVE_INTERVAL_SECONDS."""
+    while True:
+        await save_requested.wait()
+        # Requests made from here on need a new save, as the snapshot is taken now
+        save_requested.clear()
+        try:
+            await save_db(db)
+        except Exception as e:
+            # Never let a failed save end the task; retry on the next pass
+            print(f"❌ Failed to save DB: {e!r}")
+            save_requested.set()
+        await asyncio.sleep(SAVE_INTERVAL_SECONDS)
+
+
+def load_challenge_cache():
+    """Challenge categories never change, so they are kept across restarts."""
+    if os.path.exists(CHALLENGE_CACHE_FILE):
+        try:
+            with open(CHALLENGE_CACHE_FILE, "rb") as f:
+                return {int(cid): cat for cid, cat in orjson.loads(f.read()).items()}
+        except (orjson.JSONDecodeError, ValueError):
+            print("⚠️ Challenge cache corrupt. Starting with an empty cache.")
+    return {}
+
+
+async def save_challenge_cache(cache):
+    payload = orjson.dumps(cache, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    await asyncio.to_thread(write_file_atomic, CHALLENGE_CACHE_FILE, payload)
+
+
+def build_discord_index(data):
+    """Maps each Discord user ID to their tracked HTB IDs (in DB order)."""
+    index = {}
+    for htb_id, user in data["users"].items():
+        if "discord_id" in user:
+            index.setdefault(user["discord_id"], []).append(htb_id)
+    return index
 
 
 db = load_db()
+discord_to_htb = build_discord_index(db)
+challenge_cache = load_challenge_cache()
+challenge_cache_dirty = False
 
 
 # ================= HTB API HELPER =================
-def make_htb_request(endpoint):
+htb_semaphore = asyncio.Semaphore(HTB_MAX_CONCURRENCY)
+
+# Returned when a conditional request answers 304 (nothing changed)
+NOT_MODIFIED = object()
+
+
+async def make_htb_request(endpoint, validators=None):
+    """GETs an HTB endpoint and returns the decoded JSON (or None on error).
+
+    If `validators` is given, its "etag"/"last_modified" values are sent as
+    conditional headers and replaced with the ones from a 200 response.
+    """
     url = f"{HTB_API_URL}{endpoint}"
-    headers = {
-        "Authorization": f"Bearer {HTB_API_TOKEN}",
-        "User-Agent": "DiscordBot/1.0",
-        "Accept": "application/json",
-    }
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
     try:
-        response = requests.get(url, headers=headers, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        elif response.status_code == 404:
-            return None
-        elif response.status_code == 401:
-            print(f"⚠️ 401 Unauthorized: Check your HTB_API_TOKEN.")
-            return None
-        else:
-            print(f"⚠️ API Error {response.status_code} on {url}")
-            return None
+        async with htb_semaphore, bot.http_session.get(
+            url, headers=headers
+        ) as response:
+            if response.status == 200:
+                if validators is not None:
+                    validators["etag"] = response.headers.get("ETag")
+                    validators["last_modified"] = response.headers.get("Last-Modified")
+                return await response.json(content_type=None, loads=orjson.loads)
+            elif response.status == 304:
+                return NOT_MODIFIED
+            elif response.status == 404:
+                return None
+            elif response.status == 401:
+                print(f"⚠️ 401 Unauthorized: Check your HTB_API_TOKEN.")
+                return None
+            else:
+                print(f"⚠️ API Error {response.status} on {url}")
+                return None
     except Exception as e:
         print(f"❌ Connection Error: {e}")
         return None
 
 
-def get_user_activity(user_id):
-    """Returns activity (User/Root separated)."""
-    data = make_htb_request(f"/api/v4/user/profile/activity/{user_id}")
+async def get_user_activity(user_id, validators=None):
+    """Returns activity (User/Root separated), or NOT_MODIFIED."""
+    data = await make_htb_request(
+        f"/api/v4/user/profile/activity/{user_id}", validators
+    )
+    if data is NOT_MODIFIED:
+        return NOT_MODIFIED
     if data:
         return data.get("profile", {}).get("activity", [])
     return None
 
 
-def get_user_details(user_id):
-    """Returns Name and Avatar URL."""
-    data = make_htb_request(f"/api/v4/user/profile/basic/{user_id}")
+user_details_cache = {}  # user_id -> (expires_at, (name, avatar))
+
+
+async def get_user_details(user_id):
+    """Returns Name and Avatar URL (cached for USER_DETAILS_TTL seconds)."""
+    cached = user_details_cache.get(user_id)
+    if cached and cached[0] > monotonic():
+        return cached[1]
+
+    data = await make_htb_request(f"/api/v4/user/profile/basic/{user_id}")
     if data:
         profile = data.get("profile", {})
         name = profile.get("name", "Unknown")
@@ -122,14 +280,24 @@ def get_user_details(user_id):
             avatar = f"https://labs.hackthebox.com{avatar}"
         if not avatar:
             avatar = "https://labs.hackthebox.com/images/logo-htb.png"
+        user_details_cache[user_id] = (monotonic() + USER_DETAILS_TTL, (name, avatar))
         return name, avatar
     return "Unknown", "https://labs.hackthebox.com/images/logo-htb.png"
 
 
-def get_challenge_info(challenge_id):
-    data = make_htb_request(f"/api/v4/challenge/info/{challenge_id}")
+async def get_challenge_info(challenge_id):
+    """Returns the category name of a challenge (cached per challenge ID)."""
+    global challenge_cache_dirty
+    if challenge_id in challenge_cache:
+        return challenge_cache[challenge_id]
+
+    data = await make_htb_request(f"/api/v4/challenge/info/{challenge_id}")
     if data:
-        return data.get("challenge", {}).get("category_name")
+        category = data.get("challenge", {}).get("category_name")
+        if category:
+            challenge_cache[challenge_id] = category
+            challenge_cache_dirty = True
+        return category
     return None
 
 
@@ -148,14 +316,13 @@ async def perform_reset_logic(channel):
 
         goals_met = (m_count >= GOAL_MACHINES) and (c_count >= GOAL_CHALLENGES)
 
+        # Keep the raw values; only the lines that fit in the report get formatted
         if goals_met:
             user["streak"] = user.get("streak", 0) + 1
-            completed_list.append(f"🔥 **{user['name']}** (Streak: {user['streak']})")
+            completed_list.append((user["name"], user["streak"]))
         else:
             user["streak"] = 0
-            failed_list.append(
-                f"💀 **{user['name']}** ({m_count}/{GOAL_MACHINES} 🖥️, {c_count}/{GOAL_CHALLENGES} 🧩)"
-            )
+            failed_list.append((user["name"], m_count, c_count))
 
             # Collect Discord ID for roasting
             if "discord_id" in user:
@@ -165,22 +332,34 @@ async def perform_reset_logic(channel):
         user["machines"] = 0
         user["challenges"] = 0
 
-    save_db(db)
+    request_save()
 
     # Report Embed
-    embed = discord.Embed(
-        title="🗓️ Weekly Reset & Report",
-        description="The week has ended! Here is the breakdown:",
-        color=discord.Color.dark_grey(),
-    )
-
-    def format_list(lst):
-        text = "\n".join(lst)
-        return text[:1000] + "..." if len(text) > 1000 else text
+    embed = EMBED_TEMPLATES["reset"].copy()
+
+    def format_list(rows, fmt, limit=1000):
+        """Joins the formatted rows, stopping once `limit` chars are exceeded."""
+        lines = []
+        length = 0
+        for row in rows:
+            line = fmt(*row)
+            length += len(line) + (1 if lines else 0)
+            lines.append(line)
+            if length > limit:
+                return "\n".join(lines)[:limit] + "..."
+        return "\n".join(lines)
+
+    def format_completed(name, streak):
+        return f"🔥 **{name}** (Streak: {streak})"
+
+    def format_failed(name, m_count, c_count):
+        return f"💀 **{name}** ({m_count}/{GOAL_MACHINES} 🖥️, {c_count}/{GOAL_CHALLENGES} 🧩)"
 
     if completed_list:
         embed.add_field(
-            name="✅ Goal Achieved", value=format_list(completed_list), inline=False
+            name="✅ Goal Achieved",
+            value=format_list(completed_list, format_completed),
+            inline=False,
         )
     else:
         embed.add_field(
@@ -191,7 +370,9 @@ async def perform_reset_logic(channel):
 
     if failed_list:
         embed.add_field(
-            name="❌ Missed Goals", value=format_list(failed_list), inline=False
+            name="❌ Missed Goals",
+            value=format_list(failed_list, format_failed),
+            inline=False,
         )
     else:
         embed.add_field(
@@ -210,164 +391,163 @@ async def perform_reset_logic(channel):
 # ================= COMMANDS =================
 
 
-@bot.command()
-async def track(ctx):
-    """Starts the tracking process via DM."""
-    await ctx.send(f"{ctx.author.mention} Check your DMs!")
-    try:
-        await ctx.author.send(
-            "👋 Reply with your **HackTheBox User ID** (numbers only)."
-        )
+class Tracker(commands.Cog):
+    """User-facing tracking commands."""
 
-        def check(m):
-            return m.author == ctx.author and isinstance(m.channel, discord.DMChannel)
+    def __init__(self, bot):
+        self.bot = bot
 
-        msg = await bot.wait_for("message", check=check, timeout=600.0)
-
-        if not msg.content.isdigit():
-            await ctx.author.send("❌ Numbers only.")
-            return
-
-        htb_id = msg.content
-        await ctx.author.send(f"🔍 Verifying ID {htb_id}...")
-
-        htb_name, htb_avatar = get_user_details(htb_id)
-
-        if htb_name == "Unknown":
-            await ctx.author.send("❌ ID not found.")
-            return
-
-        if htb_id not in db["users"]:
-            await ctx.author.send("🔄 Initializing...")
-            # Bring the old ones so we don't count them as new
-            initial_activity = get_user_activity(htb_id)
-            existing_ids = (
-                [act["id"] for act in initial_activity] if initial_activity else []
+    @commands.command()
+    async def track(self, ctx):
+        """Starts the tracking process via DM."""
+        await ctx.send(f"{ctx.author.mention} Check your DMs!")
+        try:
+            await ctx.author.send(
+                "👋 Reply with your **HackTheBox User ID** (numbers only)."
             )
 
-            db["users"][htb_id] = {
-                "name": htb_name,
-                "discord_id": ctx.author.id,
-                "machines": 0,
-                "challenges": 0,
-                "streak": 0,
-                "solved_ids": existing_ids,
-                "user_flag_ids": [],  # Track user flags separately
-                "root_flag_ids": [],  # Track root flags
-            }
-            save_db(db)
-            await ctx.author.send(f"✅ Success! Tracking **{htb_name}**.")
-
-            main_channel = bot.get_channel(CHANNEL_ID)
-            if main_channel:
-                embed = discord.Embed(
-                    title="🕵️ New Agent Tracked!",
-                    description=f"**[{htb_name}](https://app.hackthebox.com/users/{htb_id})** joined.",
-                    color=discord.Color.blue(),
+            def check(m):
+                return m.author == ctx.author and isinstance(
+                    m.channel, discord.DMChannel
                 )
-                embed.set_thumbnail(url=htb_avatar)
-                await main_channel.send(embed=embed)
-        else:
-            await ctx.author.send(f"⚠️ **{htb_name}** is already tracked!")
 
-    except asyncio.TimeoutError:
-        await ctx.author.send("⏰ Timed out.")
-    except discord.Forbidden:
-        await ctx.send("❌ Enable DMs.")
+            msg = await self.bot.wait_for("message", check=check, timeout=600.0)
 
+            if not msg.content.isdigit():
+                await ctx.author.send("❌ Numbers only.")
+                return
 
-@bot.command()
-async def untrack(ctx):
-    """Stops the tracking."""
-    id_to_remove = None
-    for htb_id, data in db["users"].items():
-        if data["discord_id"] == ctx.author.id:
-            id_to_remove = htb_id
-            break
-    if id_to_remove:
-        del db["users"][id_to_remove]
-        save_db(db)
-        await ctx.send(f"🗑️ Stopped tracking.")
-    else:
-        await ctx.send("❓ Not tracked.")
+            htb_id = msg.content
+            await ctx.author.send(f"🔍 Verifying ID {htb_id}...")
 
+            htb_name, htb_avatar = await get_user_details(htb_id)
 
-@bot.command()
-async def stats(ctx):
-    """Personal weekly stats."""
-    found = False
-    for htb_id, data in db["users"].items():
-        if data["discord_id"] == ctx.author.id:
-            found = True
-            m_prog = data.get("machines", 0)
-            c_prog = data.get("challenges", 0)
-            streak = data.get("streak", 0)
+            if htb_name == "Unknown":
+                await ctx.author.send("❌ ID not found.")
+                return
 
-            embed = discord.Embed(
-                title=f"📊 Stats for {data['name']}", color=discord.Color.purple()
-            )
-            embed.add_field(
-                name="Progress",
-                value=f"🖥️ {m_prog}/{GOAL_MACHINES}\n🧩 {c_prog}/{GOAL_CHALLENGES}",
-                inline=True,
-            )
-            embed.add_field(name="Streak", value=f"{streak} weeks 🔥", inline=True)
-            await ctx.send(embed=embed)
-            break
-    if not found:
-        await ctx.send("❌ Use `!track`.")
+            if htb_id not in db["users"]:
+                await ctx.author.send("🔄 Initializing...")
+                # Bring the old ones so we don't count them as new
+                initial_activity = await get_user_activity(htb_id)
+                existing_ids = (
+                    {act["id"] for act in initial_activity}
+                    if initial_activity
+                    else set()
+                )
 
+                db["users"][htb_id] = {
+                    "name": htb_name,
+                    "discord_id": ctx.author.id,
+                    "machines": 0,
+                    "challenges": 0,
+                    "streak": 0,
+                    "solved_ids": existing_ids,
+                    "user_flag_ids": set(),  # Track user flags separately
+                    "root_flag_ids": set(),  # Track root flags
+                }
+                discord_to_htb.setdefault(ctx.author.id, []).append(htb_id)
+                request_save()
+                await ctx.author.send(f"✅ Success! Tracking **{htb_name}**.")
+
+                main_channel = self.bot.get_channel(CHANNEL_ID)
+                if main_channel:
+                    embed = EMBED_TEMPLATES["new_agent"].copy()
+                    embed.description = f"**[{htb_name}](https://app.hackthebox.com/users/{htb_id})** joined."
+                    embed.set_thumbnail(url=htb_avatar)
+                    await main_channel.send(embed=embed)
+            else:
+                await ctx.author.send(f"⚠️ **{htb_name}** is already tracked!")
+
+        except asyncio.TimeoutError:
+            await ctx.author.send("⏰ Timed out.")
+        except discord.Forbidden:
+            await ctx.send("❌ Enable DMs.")
+
+    @commands.command()
+    async def untrack(self, ctx):
+        """Stops the tracking."""
+        htb_ids = discord_to_htb.get(ctx.author.id)
+        if htb_ids:
+            # One HTB account per call, oldest first
+            id_to_remove = htb_ids.pop(0)
+            if not htb_ids:
+                del discord_to_htb[ctx.author.id]
+            del db["users"][id_to_remove]
+            request_save()
+            await ctx.send(f"🗑️ Stopped tracking.")
+        else:
+            await ctx.send("❓ Not tracked.")
+
+    @commands.command()
+    async def stats(self, ctx):
+        """Personal weekly stats."""
+        htb_ids = discord_to_htb.get(ctx.author.id)
+        if not htb_ids:
+            await ctx.send("❌ Use `!track`.")
+            return
 
-@bot.command()
-async def top(ctx):
-    """Shows the leaderboard (Top 10 regardless of score)."""
-    if not db["users"]:
-        await ctx.send("📉 No users are being tracked yet!")
-        return
+        data = db["users"][htb_ids[0]]
+        m_prog = data.get("machines", 0)
+        c_prog = data.get("challenges", 0)
+        streak = data.get("streak", 0)
 
-    leaderboard_data = []
+        embed = EMBED_TEMPLATES["stats"].copy()
+        embed.title = f"📊 Stats for {data['name']}"
+        embed.add_field(
+            name="Progress",
+            value=f"🖥️ {m_prog}/{GOAL_MACHINES}\n🧩 {c_prog}/{GOAL_CHALLENGES}",
+            inline=True,
+        )
+        embed.add_field(name="Streak", value=f"{streak} weeks 🔥", inline=True)
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    async def top(self, ctx):
+        """Shows the leaderboard (Top 10 regardless of score)."""
+        if not db["users"]:
+            await ctx.send("📉 No users are being tracked yet!")
+            return
 
-    for user_id, data in db["users"].items():
-        m = data.get("machines", 0)
-        c = data.get("challenges", 0)
-        s = data.get("streak", 0)
-        total_score = m + c
+        leaderboard_data = []
 
-        # Add ALL users
-        leaderboard_data.append((user_id, data["name"], m, c, s, total_score))
+        for user_id, data in db["users"].items():
+            m = data.get("machines", 0)
+            c = data.get("challenges", 0)
+            s = data.get("streak", 0)
+            total_score = m + c
 
-    # Sort: First Score, then Streak (descending)
-    leaderboard_data.sort(key=lambda x: (x[5], x[4]), reverse=True)
+            # Add ALL users
+            leaderboard_data.append((user_id, data["name"], m, c, s, total_score))
 
-    embed = discord.Embed(
-        title="🏆 Weekly Hacker Leaderboard", color=discord.Color.gold()
-    )
-    embed.description = "Ranked by Total Solves (Machines + Challenges)"
+        # Sort: First Score, then Streak (descending)
+        leaderboard_data.sort(key=lambda x: (x[5], x[4]), reverse=True)
 
-    medals = ["🥇", "🥈", "🥉"]
+        embed = EMBED_TEMPLATES["top"].copy()
 
-    # Show Top 10
-    for rank, user in enumerate(leaderboard_data[:10]):
-        uid, name, mach, chall, streak, score = user
+        medals = ["🥇", "🥈", "🥉"]
 
-        if rank < 3:
-            rank_icon = medals[rank]
-        else:
-            rank_icon = f"**#{rank + 1}**"
+        # Show Top 10
+        for rank, user in enumerate(leaderboard_data[:10]):
+            uid, name, mach, chall, streak, score = user
 
-        value_text = f"🖥️ **{mach}**  🧩 **{chall}**  |  🔥 **{streak}**"
+            if rank < 3:
+                rank_icon = medals[rank]
+            else:
+                rank_icon = f"**#{rank + 1}**"
 
-        embed.add_field(name=f"{rank_icon} {name}", value=value_text, inline=False)
+            value_text = f"🖥️ **{mach}**  🧩 **{chall}**  |  🔥 **{streak}**"
 
-    embed.set_footer(text=f"Total Tracked Hackers: {len(db['users'])}")
-    await ctx.send(embed=embed)
+            embed.add_field(name=f"{rank_icon} {name}", value=value_text, inline=False)
 
+        embed.set_footer(text=f"Total Tracked Hackers: {len(db['users'])}")
+        await ctx.send(embed=embed)
 
-@bot.command()
-@commands.has_permissions(administrator=True)
-async def reset_week(ctx):
-    """Manual Admin Command: Resets stats immediately."""
-    await perform_reset_logic(ctx.channel)
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def reset_week(self, ctx):
+        """Manual Admin Command: Resets stats immediately."""
+        await perform_reset_logic(ctx.channel)
 
 
 # ================= AUTOMATION LOOPS =================
@@ -393,128 +573,220 @@ async def check_htb_activity():
         print(f"⚠️ Error: Channel ID {CHANNEL_ID} not found.")
         return
 
-    for htb_id, user_data in list(db["users"].items()):
+    users = list(db["users"].items())
+    results = await asyncio.gather(
+        *(scan_user(channel, htb_id, user_data) for htb_id, user_data in users),
+        return_exceptions=True,
+    )
+    db_changed = False
+    for (htb_id, _), result in zip(users, results):
+        if isinstance(result, Exception):
+            print(f"❌ Scan failed for User ID {htb_id}: {result!r}")
+        # A failed scan may have been interrupted after modifying the user
+        if result:
+            db_changed = True
+
+    # Persist everything once, after all users have been scanned
+    if db_changed:
+        request_save()
+
+    global challenge_cache_dirty
+    if challenge_cache_dirty:
+        await save_challenge_cache(challenge_cache)
+        challenge_cache_dirty = False
+
+
+# --- ACTIVITY HANDLERS ---
+# Each returns (display_type, description, color, should_count), where
+# should_count means the activity is recorded in solved_ids.
+
+
+def handle_user_flag(user_data, activity, challenge_categories):
+    # User Flag: Notification ONLY. No point added.
+    # Don't add to solved_ids - we want to catch the root flag later
+    return (
+        "👤 User Flag",
+        f"**{activity.get('name')}** user access obtained! Keep going for Root! 🚀",
+        discord.Color.orange(),  # Orange for "Work in Progress"
+        False,
+    )
 
-        print(f"   > Scanning activity for User: {user_data['name']} (ID: {htb_id})...")
 
-        activities = get_user_activity(htb_id)
-        if activities is None:
-            continue
+def handle_root_flag(user_data, activity, challenge_categories):
+    # Root Flag: Counts as the Machine Solve.
+    user_data["machines"] += 1
+    user_data["root_flag_ids"].add(activity.get("id"))
+    return (
+        "💀 Root Flag",
+        f"**{activity.get('name')}** has been fully compromised! System Own3d.",
+        discord.Color.red(),  # Red for Root/Danger
+        True,
+    )
 
-        for activity in reversed(activities):
-            act_id = activity.get("id")
-            act_type = activity.get("object_type")
-            act_name = activity.get("name")
-            act_flag_type = activity.get("type")
 
-            # Check if this activity has already been processed
-            # For user flags, check user_flag_ids; for others, check solved_ids
-            already_processed = False
-            if act_type == "machine" and act_flag_type == "user":
-                user_flag_id = f"{act_id}_user"
-                already_processed = user_flag_id in user_data.get("user_flag_ids", [])
+def handle_other_machine(user_data, activity, challenge_categories):
+    # Fallback just in case. Unknown type, count it to avoid duplicates
+    return (
+        "Machine",
+        f"**{activity.get('name')}** activity detected.",
+        discord.Color.green(),
+        True,
+    )
+
+
+def handle_challenge(user_data, activity, challenge_categories):
+    user_data["challenges"] += 1
+    cat_name = challenge_categories.get(activity.get("id"))
+    display_suffix = f" ({cat_name})" if cat_name else ""
+    return (
+        "🧩 Challenge",
+        f"**{activity.get('name')}**{display_suffix} has been solved.",
+        discord.Color.green(),
+        True,
+    )
+
+
+def handle_other_activity(user_data, activity, challenge_categories):
+    # Unknown type, count it to avoid duplicates
+    return (
+        activity.get("object_type").capitalize(),
+        f"**{activity.get('name')}** completed.",
+        discord.Color.green(),
+        True,
+    )
+
+
+# Keyed by (object_type, type); a None type matches any flag type
+ACTIVITY_HANDLERS = {
+    ("machine", "user"): handle_user_flag,
+    ("machine", "root"): handle_root_flag,
+    ("machine", None): handle_other_machine,
+    ("challenge", None): handle_challenge,
+}
+
+
+async def scan_user(channel, htb_id, user_data):
+    """Processes new HTB activity for a single tracked user.
+
+    Returns True if the user's data was modified.
+    """
+    print(f"   > Scanning activity for User: {user_data['name']} (ID: {htb_id})...")
+
+    # Conditional request: HTB answers 304 if the activity hasn't changed
+    validators = {
+        "etag": user_data.get("etag"),
+        "last_modified": user_data.get("last_modified"),
+    }
+    activities = await get_user_activity(htb_id, validators)
+    if activities is None or activities is NOT_MODIFIED:
+        return False
+
+    # Activity is newest-first: stop at the first entry older than the last
+    # one seen. Same-timestamp entries are still checked against the ID sets.
+    last_date = user_data.get("last_activity_date")
+    recent_activities = []
+    for activity in activities:
+        act_date = activity.get("date")
+        if last_date and act_date and act_date < last_date:
+            break
+        recent_activities.append(activity)
+
+    # Fetch the categories of all new challenges concurrently
+    new_challenge_ids = [
+        act.get("id")
+        for act in recent_activities
+        if act.get("object_type") == "challenge"
+        and act.get("id") not in user_data["solved_ids"]
+    ]
+    categories = await asyncio.gather(
+        *(get_challenge_info(cid) for cid in new_challenge_ids)
+    )
+    challenge_categories = dict(zip(new_challenge_ids, categories))
+
+    # Fetched once, on the first new activity
+    htb_avatar = None
+    changed = False
+    pending_embeds = []
+
+    for activity in reversed(recent_activities):
+        act_id = activity.get("id")
+        act_type = activity.get("object_type")
+        act_name = activity.get("name")
+        act_flag_type = activity.get("type")
+
+        # Check if this activity has already been processed
+        # For user flags, check user_flag_ids; for others, check solved_ids
+        already_processed = False
+        if act_type == "machine" and act_flag_type == "user":
+            already_processed = act_id in user_data["user_flag_ids"]
+        else:
+            already_processed = act_id in user_data["solved_ids"]
+
+        if not already_processed:
+            changed = True
+
+            print(f"     ✅ New Solve: {act_name} ({act_type} - {act_flag_type})")
+
+            handler = ACTIVITY_HANDLERS.get((act_type, act_flag_type))
+            if handler is None:
+                handler = ACTIVITY_HANDLERS.get((act_type, None), handle_other_activity)
+            display_type, description_text, color, should_count = handler(
+                user_data, activity, challenge_categories
+            )
+
+            # Save ID so we don't alert again - only for activities that count
+            if should_count:
+                user_data["solved_ids"].add(act_id)
             else:
-                already_processed = act_id in user_data["solved_ids"]
-
-            if not already_processed:
-
-                print(f"     ✅ New Solve: {act_name} ({act_type} - {act_flag_type})")
-
-                display_type = ""
-                display_suffix = ""
-                description_text = ""
-                color = discord.Color.green()
-
-                # --- LOGIC CHANGE HERE ---
-                should_count = False  # Track if this activity should be counted
-
-                if act_type == "machine":
-                    if act_flag_type == "user":
-                        # User Flag: Notification ONLY. No point added.
-                        display_type = "👤 User Flag"
-                        description_text = f"**{act_name}** user access obtained! Keep going for Root! 🚀"
-                        color = discord.Color.orange()  # Orange for "Work in Progress"
-                        # Don't add to solved_ids - we want to catch the root flag later
-
-                    elif act_flag_type == "root":
-                        # Root Flag: Counts as the Machine Solve.
-                        user_data["machines"] += 1
-                        should_count = True  # This counts, so add to solved_ids
-                        display_type = "💀 Root Flag"
-                        description_text = (
-                            f"**{act_name}** has been fully compromised! System Own3d."
-                        )
-                        color = discord.Color.red()  # Red for Root/Danger
-
-                        # Update root_flag_ids in database
-                        if "root_flag_ids" not in user_data:
-                            user_data["root_flag_ids"] = []
-                        if act_id not in user_data["root_flag_ids"]:
-                            user_data["root_flag_ids"].append(act_id)
-                            user_data["root_flag_ids"].sort()  # Keep sorted
-
-                    else:
-                        # Fallback just in case
-                        display_type = "Machine"
-                        description_text = f"**{act_name}** activity detected."
-                        should_count = (
-                            True  # Unknown type, count it to avoid duplicates
-                        )
-
-                elif act_type == "challenge":
-                    user_data["challenges"] += 1
-                    should_count = True  # Challenges count, so add to solved_ids
-                    display_type = "🧩 Challenge"
-                    cat_name = get_challenge_info(act_id)
-                    if cat_name:
-                        display_suffix = f" ({cat_name})"
-                    description_text = (
-                        f"**{act_name}**{display_suffix} has been solved."
-                    )
-                    color = discord.Color.green()
-
-                else:
-                    display_type = act_type.capitalize()
-                    description_text = f"**{act_name}** completed."
-                    should_count = True  # Unknown type, count it to avoid duplicates
-
-                # Save ID so we don't alert again - only for activities that count
-                if should_count:
-                    user_data["solved_ids"].append(act_id)
-                else:
-                    # For user flags, use a composite key to track them separately
-                    # This prevents duplicate notifications while allowing root flags to be processed
-                    user_flag_id = f"{act_id}_user"
-                    if user_flag_id not in user_data.get("user_flag_ids", []):
-                        if "user_flag_ids" not in user_data:
-                            user_data["user_flag_ids"] = []
-                        user_data["user_flag_ids"].append(user_flag_id)
-                _, htb_avatar = get_user_details(htb_id)
-
-                # Build the Embed
-                embed = discord.Embed(
-                    title=f"🚩 {user_data['name']} got a {display_type}!",
-                    description=description_text,
-                    color=color,
-                )
-                embed.set_thumbnail(url=htb_avatar)
+                # User flags are tracked separately by machine ID
+                # This prevents duplicate notifications while allowing root flags to be processed
+                user_data["user_flag_ids"].add(act_id)
+            if htb_avatar is None:
+                _, htb_avatar = await get_user_details(htb_id)
 
-                m_prog = user_data["machines"]
-                c_prog = user_data["challenges"]
-                streak = user_data.get("streak", 0)
+            # Build the Embed
+            embed = discord.Embed(
+                title=f"🚩 {user_data['name']} got a {display_type}!",
+                description=description_text,
+                color=color,
+            )
+            embed.set_thumbnail(url=htb_avatar)
 
-                m_status = "✅" if m_prog >= GOAL_MACHINES else "❌"
-                c_status = "✅" if c_prog >= GOAL_CHALLENGES else "❌"
+            m_prog = user_data["machines"]
+            c_prog = user_data["challenges"]
+            streak = user_data.get("streak", 0)
 
-                embed.add_field(
-                    name="Weekly Progress",
-                    value=f"🖥️ {m_prog}/{GOAL_MACHINES} {m_status}\n🧩 {c_prog}/{GOAL_CHALLENGES} {c_status}",
-                    inline=True,
-                )
-                embed.add_field(name="Streak", value=f"{streak} 🔥", inline=True)
+            m_status = "✅" if m_prog >= GOAL_MACHINES else "❌"
+            c_status = "✅" if c_prog >= GOAL_CHALLENGES else "❌"
+
+            embed.add_field(
+                name="Weekly Progress",
+                value=f"🖥️ {m_prog}/{GOAL_MACHINES} {m_status}\n🧩 {c_prog}/{GOAL_CHALLENGES} {c_status}",
+                inline=True,
+            )
+            embed.add_field(name="Streak", value=f"{streak} 🔥", inline=True)
+
+            pending_embeds.append(embed)
 
-                await channel.send(embed=embed)
-                save_db(db)
+    # Discord allows up to 10 embeds per message
+    for i in range(0, len(pending_embeds), DISCORD_MAX_EMBEDS):
+        await channel.send(embeds=pending_embeds[i : i + DISCORD_MAX_EMBEDS])
+
+    # Only move the cursor and remember the validators once every activity
+    # has been handled
+    newest_date = max(
+        (act["date"] for act in recent_activities if act.get("date")), default=None
+    )
+    if newest_date and newest_date != last_date:
+        user_data["last_activity_date"] = newest_date
+        changed = True
+
+    for key, value in validators.items():
+        if user_data.get(key) != value:
+            user_data[key] = value
+            changed = True
+
+    return changed
 
 
 # --- WEEKLY RESET SCHEDULER (SATURDAY 21:00 GREEK TIME) ---
@@ -539,9 +811,16 @@ async def scheduled_weekly_reset():
 
 
 # ================= MANUAL ROOT FLAGS CHECK =================
-def check_root_flags_manual_imported():
-    """Wrapper to call the imported check_root_flags_manual function."""
-    check_root_flags_manual(HTB_API_URL, HTB_API_TOKEN, db)
+async def check_root_flags_manual_imported():
+    """Wrapper to run the imported root flags check on the bot's HTTP session."""
+    # Persist through the background saver instead of writing the file directly
+    await check_root_flags_async(
+        HTB_API_URL,
+        HTB_API_TOKEN,
+        db,
+        bot.http_session,
+        save=lambda data: request_save(),
+    )
 
 if DISCORD_TOKEN:
     bot.run(DISCORD_TOKEN)
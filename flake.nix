@@ -11,7 +11,8 @@
       inherit system;
     };
     pythonEnv = pkgs.python3.withPackages (ps: with ps; [
-      requests
+      aiohttp
+      orjson
       discordpy
       python-dotenv
       tzdata
@@ -9,50 +9,88 @@ import os
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-import json
+import asyncio
+import aiohttp
+import orjson
 
 DB_FILE = "htb_data.json"
 
+# Max concurrent requests to the HTB API (respect their rate limits)
+HTB_MAX_CONCURRENCY = 10
+
+# Retries for transient connection errors, with exponential backoff (seconds)
+HTB_MAX_RETRIES = 3
+HTB_RETRY_BACKOFF = 0.3
+
 
 def load_db():
     data = {"users": {}}
     if os.path.exists(DB_FILE):
         try:
-            with open(DB_FILE, "r") as f:
-                data = json.load(f)
-        except json.JSONDecodeError:
+            with open(DB_FILE, "rb") as f:
+                data = orjson.loads(f.read())
+        except orjson.JSONDecodeError:
             print("JSON Corrupt. Starting fresh (Old file backed up).")
             os.rename(DB_FILE, f"{DB_FILE}.bak")
+
+    for user_data in data.get("users", {}).values():
+        for key in ("solved_ids", "user_flag_ids", "root_flag_ids"):
+            user_data[key] = set(user_data.get(key, []))
+        # Legacy user flags were stored as "<machine id>_user" strings
+        user_data["user_flag_ids"] = {
+            fid if isinstance(fid, int) else int(fid.split("_")[0])
+            for fid in user_data["user_flag_ids"]
+            if isinstance(fid, int) or fid.split("_")[0].isdigit()
+        }
     return data
 
 
-def save_db(data):
-    with open(DB_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+def json_default(obj):
+    if isinstance(obj, set):
+        return sorted(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 
-def get_user_activity(user_id, htb_api_url, htb_api_token):
-    import requests
+def save_db(data):
+    tmp_file = f"{DB_FILE}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(orjson.dumps(data, default=json_default, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_file, DB_FILE)
+
 
+async def get_user_activity(session, semaphore, user_id, htb_api_url):
     url = f"{htb_api_url}/api/v4/user/profile/activity/{user_id}"
-    headers = {
-        "Authorization": f"Bearer {htb_api_token}",
-        "User-Agent": "DiscordBot/1.0",
-        "Accept": "application/json",
-    }
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("profile", {}).get("activity", [])
-        return None
-    except Exception as e:
-        print(f"Connection Error: {e}")
-        return None
+    for attempt in range(HTB_MAX_RETRIES + 1):
+        try:
+            async with semaphore, session.get(url) as response:
+                if response.status == 200:
+                    data = await response.json(content_type=None, loads=orjson.loads)
+                    return data.get("profile", {}).get("activity", [])
+                return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == HTB_MAX_RETRIES:
+                print(f"Connection Error: {e}")
+                return None
+            # Transient error: back off (0.3s, 0.6s, 1.2s) and try again
+            await asyncio.sleep(HTB_RETRY_BACKOFF * 2**attempt)
+        except Exception as e:
+            print(f"Connection Error: {e}")
+            return None
 
 
 def check_root_flags_manual(htb_api_url, htb_api_token, db=None):
     """Check, update, and print users with root flags."""
+    return asyncio.run(check_root_flags_async(htb_api_url, htb_api_token, db))
+
+
+async def check_root_flags_async(
+    htb_api_url, htb_api_token, db=None, session=None, save=save_db
+):
+    """Async version of check_root_flags_manual.
+
+    Can reuse an aiohttp session, and `save(db)` replaces the direct file write
+    (e.g. so the bot can persist through its own saver).
+    """
     if db is None:
         db = load_db()
 
@@ -65,21 +103,35 @@ def check_root_flags_manual(htb_api_url, htb_api_token, db=None):
     root_flag_data = []
     updated_count = 0
 
-    for htb_id, user_data in db["users"].items():
-        user_name = user_data.get("name", "Unknown")
-        solved_ids = set(user_data.get("solved_ids", []))
-        user_flag_ids = user_data.get("user_flag_ids", [])
-
-        if "root_flag_ids" not in user_data:
-            user_data["root_flag_ids"] = []
+    # Fetch every user's activity concurrently
+    own_session = session is None
+    if own_session:
+        session = aiohttp.ClientSession(
+            headers={
+                "Authorization": f"Bearer {htb_api_token}",
+                "User-Agent": "DiscordBot/1.0",
+                "Accept": "application/json",
+            },
+            timeout=aiohttp.ClientTimeout(total=10),
+        )
+    semaphore = asyncio.Semaphore(HTB_MAX_CONCURRENCY)
+    users = list(db["users"].items())
+    try:
+        all_activities = await asyncio.gather(
+            *(
+                get_user_activity(session, semaphore, htb_id, htb_api_url)
+                for htb_id, _ in users
+            )
+        )
+    finally:
+        if own_session:
+            await session.close()
 
-        user_flag_machine_ids = {
-            int(uid.split("_")[0])
-            for uid in user_flag_ids
-            if "_user" in uid and uid.split("_")[0].isdigit()
-        }
+    for (htb_id, user_data), activities in zip(users, all_activities):
+        user_name = user_data.get("name", "Unknown")
+        solved_ids = user_data["solved_ids"]
+        user_flag_machine_ids = user_data["user_flag_ids"]
 
-        activities = get_user_activity(htb_id, htb_api_url, htb_api_token)
         if not activities:
             continue
 
@@ -104,32 +156,34 @@ def check_root_flags_manual(htb_api_url, htb_api_token, db=None):
         update_messages = []
 
         if root_flags:
-            new_root_flag_ids = sorted(root_flags.keys())
-            old_root_flag_ids = sorted(user_data.get("root_flag_ids", []))
+            new_root_flag_ids = root_flags.keys()
+            old_root_flag_ids = user_data["root_flag_ids"]
             root_flag_count = len(new_root_flag_ids)
 
-            if new_root_flag_ids != old_root_flag_ids:
-                user_data["root_flag_ids"] = new_root_flag_ids
+            # Any ID in only one of the two sets means the stored flags are stale
+            root_flags_changed = bool(new_root_flag_ids ^ old_root_flag_ids)
+            if root_flags_changed:
+                user_data["root_flag_ids"] = set(new_root_flag_ids)
                 needs_update = True
 
             current_machines = user_data.get("machines", 0)
             if current_machines != root_flag_count:
                 user_data["machines"] = root_flag_count
                 needs_update = True
-                if new_root_flag_ids == old_root_flag_ids:
+                if not root_flags_changed:
                     update_messages.append(
                         f"machines count = {root_flag_count} (was {current_machines})"
                     )
 
-            if new_root_flag_ids != old_root_flag_ids:
+            if root_flags_changed:
                 update_messages.append(
                     f"{root_flag_count} root flag(s), machines count = {root_flag_count}"
                 )
 
             root_flag_data.append((user_name, htb_id, root_flags))
         else:
-            if user_data.get("root_flag_ids"):
-                user_data["root_flag_ids"] = []
+            if user_data["root_flag_ids"]:
+                user_data["root_flag_ids"] = set()
                 needs_update = True
             if user_data.get("machines", 0) > 0:
                 user_data["machines"] = 0
@@ -150,7 +204,7 @@ def check_root_flags_manual(htb_api_url, htb_api_token, db=None):
                 print(f"   Updated {user_name}: {', '.join(update_messages)}")
 
     if updated_count > 0:
-        save_db(db)
+        save(db)
         print(f"\nDatabase updated! ({updated_count} user(s) modified)\n")
 
     if not root_flag_data: